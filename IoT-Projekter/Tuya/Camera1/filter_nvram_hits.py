@@ -3,7 +3,8 @@ import json, sys
 data = json.load(open(sys.argv[1]))
 
 for path, info in data.items():
-    if any(k in info for k in ("keyword_hits", "ascii_kv", "utf16_kv")):
+    decoded = info.get("decoded", {})
+    if any(k in info or k in decoded for k in ("keyword_hits", "ascii_kv", "utf16_kv")):
         print("=== HIT:", path)
         if "keyword_hits" in info:
             print("  keywords:", info["keyword_hits"])
@@ -11,4 +12,10 @@ for path, info in data.items():
             print("  ascii kv:", info["ascii_kv"])
         if "utf16_kv" in info:
             print("  utf16 kv:", info["utf16_kv"])
+        if "keyword_hits" in decoded:
+            print(f"  [{decoded['codec']}] keywords:", decoded["keyword_hits"])
+        if "ascii_kv" in decoded:
+            print(f"  [{decoded['codec']}] ascii kv:", decoded["ascii_kv"])
+        if "utf16_kv" in decoded:
+            print(f"  [{decoded['codec']}] utf16 kv:", decoded["utf16_kv"])
         print()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+ssdeep-style context-triggered piecewise hashing (CTPH), stdlib only.
+
+Chunk boundaries are content-defined, so an insertion or a changed value only
+disturbs the signature characters around it. Trigger points are found at C
+speed: every byte is mapped to a pseudo-random bit with bytes.translate and a
+boundary is a run of `level` set bits. Chunks are hashed with crc32.
+
+Hash format is "level:sig1:sig2", where sig2 uses level + 1 (about half as
+many chunks), so hashes one level apart can still be compared.
+"""
+import re
+import zlib
+from typing import Callable, Dict, List, Any, Hashable, Optional
+
+B64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+SPAMSUM_LENGTH = 64
+MIN_LEVEL = 2
+# ssdeep only compares signatures sharing a substring of this length;
+# the same n-grams are the keys of the LSH buckets
+NGRAM = 7
+
+# fixed pseudo-random byte -> bit table (LCG, so hashes are stable across runs)
+_bits = bytearray(256)
+_x = 0x2802_1967
+for _i in range(256):
+    _x = (_x * 1103515245 + 12345) & 0x7FFFFFFF
+    _bits[_i] = (_x >> 16) & 1
+TRIGGER_TABLE = bytes(_bits)
+del _bits, _x, _i
+
+_trigger_res: Dict[int, Any] = {}
+
+
+def _trigger_re(level: int):
+    if level not in _trigger_res:
+        _trigger_res[level] = re.compile(b"\x01{%d}" % level)
+    return _trigger_res[level]
+
+
+def _signature(data: bytes, bits: bytes, level: int, max_len: int) -> str:
+    sig = []
+    start = 0
+    for m in _trigger_re(level).finditer(bits):
+        if len(sig) == max_len - 1:
+            break
+        end = m.end()
+        sig.append(B64[zlib.crc32(data[start:end]) & 63])
+        start = end
+    if start < len(data):
+        sig.append(B64[zlib.crc32(data[start:]) & 63])
+    return "".join(sig)
+
+
+def fuzzy_hash(data: bytes) -> str:
+    # expected chunk length for a run of L set bits is about 2**(L+1)
+    level = MIN_LEVEL
+    while (2 << level) * SPAMSUM_LENGTH < len(data):
+        level += 1
+
+    bits = data.translate(TRIGGER_TABLE)
+    while True:
+        sig1 = _signature(data, bits, level, SPAMSUM_LENGTH)
+        if len(sig1) >= SPAMSUM_LENGTH // 2 or level <= MIN_LEVEL:
+            break
+        level -= 1
+    sig2 = _signature(data, bits, level + 1, SPAMSUM_LENGTH // 2)
+    return f"{level}:{sig1}:{sig2}"
+
+
+def _parse(h: str):
+    level, sig1, sig2 = h.split(":", 2)
+    return int(level), _squeeze(sig1), _squeeze(sig2)
+
+
+def _squeeze(sig: str) -> str:
+    # runs of >3 identical characters carry no information (padding, zeros)
+    return re.sub(r"(.)\1{3,}", r"\1\1\1", sig)
+
+
+def _edit_distance(a: str, b: str) -> int:
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def _has_common_ngram(a: str, b: str) -> bool:
+    grams = {a[i:i + NGRAM] for i in range(len(a) - NGRAM + 1)}
+    return any(b[i:i + NGRAM] in grams for i in range(len(b) - NGRAM + 1))
+
+
+def _score(a: str, b: str) -> int:
+    if a == b:
+        return 100
+    if not _has_common_ngram(a, b):
+        return 0
+    dist = _edit_distance(a, b) * SPAMSUM_LENGTH // (len(a) + len(b))
+    dist = 100 * dist // SPAMSUM_LENGTH
+    return max(0, 100 - dist)
+
+
+def fuzzy_compare(h1: str, h2: str) -> int:
+    """Similarity of two fuzzy hashes, 0 (unrelated) .. 100 (identical)."""
+    l1, a1, a2 = _parse(h1)
+    l2, b1, b2 = _parse(h2)
+    if l1 == l2:
+        return max(_score(a1, b1), _score(a2, b2))
+    if l1 + 1 == l2:
+        return _score(a2, b1)
+    if l2 + 1 == l1:
+        return _score(a1, b2)
+    return 0
+
+
+def _lsh_keys(h: str) -> List[Any]:
+    level, sig1, sig2 = _parse(h)
+    keys = [(level, sig1[i:i + NGRAM]) for i in range(len(sig1) - NGRAM + 1)]
+    keys += [(level + 1, sig2[i:i + NGRAM]) for i in range(len(sig2) - NGRAM + 1)]
+    # very short inputs have no n-gram; bucket them on the whole signature
+    return keys or [(level, sig1)]
+
+
+def cluster_by_similarity(hashes: Dict[Hashable, str], threshold: int = 80) -> List[List[Hashable]]:
+    """
+    Group items whose fuzzy hashes score >= threshold. Candidate pairs come
+    from LSH buckets (shared signature n-grams), so only items that could
+    possibly match are compared. Clusters keep the input order of items.
+    """
+    parent = {k: k for k in hashes}
+
+    def find(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    buckets: Dict[Any, List[Hashable]] = {}
+    for k, h in hashes.items():
+        for key in set(_lsh_keys(h)):
+            buckets.setdefault(key, []).append(k)
+
+    for members in buckets.values():
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                ra, rb = find(a), find(b)
+                if ra == rb:
+                    continue
+                if fuzzy_compare(hashes[a], hashes[b]) >= threshold:
+                    parent[rb] = ra
+
+    clusters: Dict[Hashable, List[Hashable]] = {}
+    for k in hashes:
+        clusters.setdefault(find(k), []).append(k)
+    return list(clusters.values())
+
+
+def _common_prefix_len(a: bytes, b: bytes) -> int:
+    # binary search with slice compares (memcmp) instead of a byte loop
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def summarize_diff(rep: bytes, other: bytes, rep_hash: Optional[str] = None,
+                   other_hash: Optional[str] = None) -> Dict[str, Any]:
+    """Cheap summary of how `other` differs from the cluster representative."""
+    prefix = _common_prefix_len(rep, other)
+    max_suffix = min(len(rep), len(other)) - prefix
+    suffix = _common_prefix_len(rep[::-1][:max_suffix], other[::-1][:max_suffix])
+    out: Dict[str, Any] = {
+        "size_delta": len(other) - len(rep),
+        "identical": rep == other,
+        "common_prefix": prefix,
+        "common_suffix": suffix,
+        "changed_range": [prefix, len(other) - suffix],
+    }
+    if rep_hash and other_hash:
+        out["similarity"] = fuzzy_compare(rep_hash, other_hash)
+    return out
+
+
+# file contents kept in memory between the hashing pass and the analysis
+# pass, so cluster members are not read from disk twice
+CACHE_LIMIT = 256 * 1024 * 1024
+
+
+class ContentCache:
+    """
+    Holds file contents read during hashing, up to `limit` bytes in total.
+    get() hands each entry out once (then frees it) and falls back to
+    `loader` for entries that did not fit.
+    """
+
+    def __init__(self, loader: Callable[[Hashable], bytes], limit: int = CACHE_LIMIT):
+        self.loader = loader
+        self.limit = limit
+        self.size = 0
+        self.data: Dict[Hashable, bytes] = {}
+
+    def put(self, key: Hashable, data: bytes):
+        if self.size + len(data) <= self.limit:
+            self.data[key] = data
+            self.size += len(data)
+
+    def get(self, key: Hashable) -> bytes:
+        data = self.data.pop(key, None)
+        if data is None:
+            return self.loader(key)
+        self.size -= len(data)
+        return data
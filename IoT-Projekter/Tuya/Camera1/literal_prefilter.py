@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Literal prefilter: cheap substring checks before expensive regexes.
+
+Most files contain none of the literals a pattern needs (e.g. NV_GET_RE can
+only match where "nvram" occurs). required_literals() pulls those literals
+out of a compiled regex; LiteralPrefilter uses them to reject data outright
+(C-speed `in` checks) and to cut the data down to windows around the literal
+hits, so the regexes only run where a match is possible.
+"""
+import re
+from typing import List, Optional, Set, Tuple
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+LITERAL = sre_constants.LITERAL
+SUBPATTERN = sre_constants.SUBPATTERN
+BRANCH = sre_constants.BRANCH
+REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, "POSSESSIVE_REPEAT"):
+    REPEATS.add(sre_constants.POSSESSIVE_REPEAT)
+
+# window half-width for patterns with unbounded repeats (\s+, [..]+ ...).
+# Windows are extended past their end when a match runs into it, but such a
+# pattern is only found if its match starts within MAX_SPAN of the literal.
+MAX_SPAN = 512
+
+# pattern literals shorter than this ("ov", "dp", "{") occur almost
+# everywhere; on their own they only count once a pattern really matches
+MIN_LITERAL = 3
+# weak-literal hits checked window by window before present() gives up and
+# runs the patterns once over the rest of the data
+MAX_WEAK_HITS = 64
+
+# bytes that are everywhere in firmware images and make poor literals
+COMMON_CHARS = "\x00\xff \t\r\n"
+
+
+def _rank(lits: Set[str]):
+    # prefer the set whose shortest literal is longest (fewer false hits),
+    # not counting padding/whitespace characters
+    return min(len(l) - sum(l.count(c) for c in COMMON_CHARS) for l in lits), -len(lits)
+
+
+def _better(a: Optional[Set[str]], b: Optional[Set[str]]) -> Optional[Set[str]]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a if _rank(a) >= _rank(b) else b
+
+
+def _required(items) -> Optional[Set[str]]:
+    """One-of set of literals every match of this sequence contains, or None."""
+    best = None
+    run: List[str] = []
+    for op, av in list(items) + [(None, None)]:
+        if op is LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            best = _better(best, {"".join(run)})
+            run = []
+        cand = None
+        if op is SUBPATTERN:
+            cand = _required(av[-1])
+        elif op is BRANCH:
+            subs = [_required(b) for b in av[1]]
+            if all(subs):
+                cand = set().union(*subs)
+        elif op in REPEATS and av[0] >= 1:
+            cand = _required(av[2])
+        best = _better(best, cand)
+    return best
+
+
+def required_literals(regex) -> Optional[List]:
+    """
+    Literals of which at least one occurs in every match of regex, or None if
+    no such literal could be found (e.g. pure character-class patterns).
+    Case-insensitive patterns give lower-case literals.
+    """
+    lits = _required(sre_parse.parse(regex.pattern, regex.flags))
+    if not lits:
+        return None
+    if regex.flags & re.IGNORECASE:
+        lits = {l.lower() for l in lits}
+    if isinstance(regex.pattern, bytes):
+        return sorted(l.encode("latin1") for l in lits)
+    return sorted(lits)
+
+
+def max_width(regex) -> int:
+    lo, hi = sre_parse.parse(regex.pattern, regex.flags).getwidth()
+    return min(hi, MAX_SPAN)
+
+
+class LiteralPrefilter:
+    def __init__(self, patterns, literals=()):
+        """
+        patterns: compiled regexes (all str or all bytes) that the filter
+        guards; literals: extra literals to look for (e.g. plain keywords).
+        """
+        self.patterns = list(patterns)
+        self.literals = set(literals)
+        # keywords are hits in themselves, so they are never weak
+        self.weak = set()
+        self.ignorecase = False
+        # a pattern without required literals can match anywhere
+        self.always = False
+        self.span = 0
+        for regex in patterns:
+            req = required_literals(regex)
+            if req is None:
+                self.always = True
+            else:
+                self.literals.update(req)
+                self.weak.update(l for l in req if len(l) < MIN_LITERAL)
+            if regex.flags & re.IGNORECASE:
+                self.ignorecase = True
+            self.span = max(self.span, max_width(regex))
+
+        # longest first, so the alternation prefers the most specific literal
+        self.literals = sorted(self.literals, key=len, reverse=True)
+        self.weak -= set(literals)
+        self.strong = [l for l in self.literals if l not in self.weak]
+        self._re = self._weak_re = None
+        if self.literals:
+            sep = b"|" if isinstance(self.literals[0], bytes) else "|"
+            self._re = re.compile(sep.join(re.escape(l) for l in self.literals),
+                                  re.IGNORECASE if self.ignorecase else 0)
+        if self.weak:
+            # matched against the lowered text, so no IGNORECASE needed
+            weak = sorted(self.weak, key=len, reverse=True)
+            self._weak_re = re.compile(sep.join(re.escape(l) for l in weak))
+
+    def _text(self, data, lowered):
+        if not self.ignorecase:
+            return data
+        return data.lower() if lowered is None else lowered
+
+    def found(self, data, lowered=None) -> Set:
+        """The literals present in data (lowered: data.lower(), if the caller has it)."""
+        text = self._text(data, lowered)
+        return {lit for lit in self.literals if lit in text}
+
+    def present(self, data, lowered=None) -> bool:
+        """
+        False if the guarded patterns cannot possibly match in data. Only weak
+        (short) literals present means a pattern has to match for real.
+        lowered: data.lower(), so callers with several filters lower once.
+        """
+        if self.always:
+            return True
+        text = self._text(data, lowered)
+        if any(lit in text for lit in self.strong):
+            return True
+        if not any(lit in text for lit in self.weak):
+            return False
+        return self._confirm(data, text)
+
+    def _confirm(self, data, text) -> bool:
+        """
+        Whether a pattern matches around a weak-literal hit. Every such match
+        lies within self.span of its literal. Windows are merged as in
+        windows() and never searched twice; after MAX_WEAK_HITS hits the
+        rest is searched in one go. So this never searches more than one
+        pass of the data, i.e. it costs no more than the patterns themselves.
+        """
+        def search(start, end=None):
+            end = len(data) if end is None else end
+            return any(regex.search(data, start, end) for regex in self.patterns)
+
+        if len(text) != len(data):
+            return search(0)
+        start = end = 0
+        for i, m in enumerate(self._weak_re.finditer(text)):
+            if i == MAX_WEAK_HITS:
+                return search(start)
+            lo = max(0, m.start() - self.span)
+            if lo > end:
+                if end > start and search(start, end):
+                    return True
+                start = lo
+            end = m.end() + self.span
+        return end > start and search(start, end)
+
+    def windows(self, data, pos: int = 0, endpos: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Merged (start, end) ranges of data around literal hits. Any match that
+        starts in [pos, endpos) and is no wider than self.span lies entirely
+        inside one of them. When the hits are so dense that the windows would
+        cover the range anyway (e.g. "=" in binary data), the whole range is
+        returned without walking the hits.
+        """
+        if endpos is None:
+            endpos = len(data)
+        if self.always:
+            return [(pos, len(data))]
+        if self._re is None:
+            return []
+        if not self.ignorecase:
+            hits = sum(data.count(lit, pos, endpos) for lit in self.literals)
+            if hits * 2 * self.span >= endpos - pos:
+                return [(pos, len(data))]
+        out: List[Tuple[int, int]] = []
+        # a match starting at >= pos can only contain literals at >= pos
+        for m in self._re.finditer(data, pos):
+            if m.start() - self.span >= endpos:
+                break
+            start = max(pos, m.start() - self.span)
+            end = min(len(data), m.end() + self.span)
+            if out and start <= out[-1][1]:
+                out[-1] = (out[-1][0], max(out[-1][1], end))
+            else:
+                out.append((start, end))
+        return out
+
+    def finditer(self, regex, data, pos: int = 0, endpos: Optional[int] = None):
+        """
+        regex.finditer(data, pos), run only inside windows(data, pos, endpos).
+        The window end acts as the end of the data, so a match that runs
+        into it is matched again without it and may extend past the window.
+        """
+        resume = pos
+        for start, end in self.windows(data, pos, endpos):
+            p = max(start, resume)
+            while p < end:
+                for m in regex.finditer(data, p, end):
+                    if m.end() == end < len(data):
+                        break
+                    yield m
+                    resume = max(m.end(), m.start() + 1)
+                else:
+                    break
+                # m ran into the window end: match it again without the end
+                full = regex.match(data, m.start())
+                if full is None:
+                    p = m.start() + 1
+                    continue
+                yield full
+                p = resume = max(full.end(), full.start() + 1)
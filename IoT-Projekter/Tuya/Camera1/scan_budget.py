@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Per-file scan budgets, so one pathological file cannot dominate a run.
+
+Each scanned file gets a fresh ScanBudget (see fresh()). Every category
+(e.g. "base64_like") has its own hit and byte counters; limits are the
+defaults below unless overridden per category. The deadline is wall-clock
+seconds since the file scan started. When a limit is reached the category
+stops early and shows up in report() with the reason and the counts reached
+so far.
+
+Byte and deadline checks are made per batch of strings (batches()) or per
+buffer (allow()), not per string, so the normal case stays cheap.
+"""
+import time
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Any, Optional
+
+DEFAULT_LIMITS: Dict[str, float] = {
+    "max_hits": 2000,
+    "max_bytes": 16 * 1024 * 1024,
+    "deadline": 30.0,
+}
+
+# strings per byte/deadline check in batches()
+BATCH = 512
+# matches per deadline check in take_from()
+DEADLINE_EVERY = 256
+
+
+class ScanBudget:
+    def __init__(self, limits: Optional[Dict[str, float]] = None,
+                 overrides: Optional[Dict[str, Dict[str, float]]] = None):
+        self.start = time.monotonic()
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.overrides = overrides or {}
+        self.hits: Dict[str, int] = {}
+        self.bytes: Dict[str, int] = {}
+        self.truncated: Dict[str, str] = {}
+
+    def fresh(self) -> "ScanBudget":
+        """A new budget with the same limits, for the next file."""
+        return ScanBudget(self.limits, self.overrides)
+
+    def limit(self, cat: str, key: str) -> float:
+        return self.overrides.get(cat, {}).get(key, self.limits[key])
+
+    def _stop(self, cat: str, reason: str):
+        self.truncated.setdefault(cat, reason)
+
+    def expired(self, cat: str) -> bool:
+        """True once cat's deadline (honouring overrides) has passed; stops cat."""
+        if self.truncated.get(cat) == "deadline":
+            return True
+        if time.monotonic() - self.start <= self.limit(cat, "deadline"):
+            return False
+        self._stop(cat, "deadline")
+        return True
+
+    def allow(self, cat: str, nbytes: int) -> int:
+        """
+        Ask to scan nbytes more for cat. Returns how many of them may be
+        scanned; 0 once the category has stopped.
+        """
+        if cat in self.truncated or self.expired(cat):
+            return 0
+        used = self.bytes.get(cat, 0)
+        room = int(self.limit(cat, "max_bytes")) - used
+        if nbytes > room:
+            self._stop(cat, "max_bytes")
+            nbytes = max(room, 0)
+        self.bytes[cat] = used + nbytes
+        return nbytes
+
+    def batches(self, cat: str, strings: List[Any]) -> Iterator[List[Any]]:
+        """
+        Yield the strings (str or bytes) cat may scan in lists of up to BATCH,
+        checking the byte and deadline budgets once per batch. Stops once cat
+        has stopped; callers break out themselves when take() drops a hit.
+        """
+        for i in range(0, len(strings), BATCH):
+            batch = strings[i:i + BATCH]
+            total = sum(map(len, batch))
+            allowed = self.allow(cat, total)
+            if allowed < total:
+                clipped = []
+                for s in batch:
+                    if allowed <= 0:
+                        break
+                    clipped.append(s[:allowed])
+                    allowed -= len(s)
+                batch = clipped
+            yield batch
+            if cat in self.truncated:
+                return
+
+    def take(self, cat: str, items: List[Any]) -> List[Any]:
+        """
+        Count items as hits for cat; drops those over the hit limit. cat is
+        only marked truncated when an item is actually dropped.
+        """
+        hits = self.hits.get(cat, 0)
+        room = int(self.limit(cat, "max_hits")) - hits
+        if len(items) > room:
+            self._stop(cat, "max_hits")
+            items = items[:max(room, 0)]
+        self.hits[cat] = hits + len(items)
+        return items
+
+    def take_from(self, cat: str, matches: Iterable[Any]) -> List[Any]:
+        """
+        Pull hits from a lazy iterator (e.g. regex.finditer) only up to the
+        hit limit, checking the deadline every DEADLINE_EVERY matches, so a
+        huge input stops early instead of being matched in full.
+        """
+        hits = self.hits.get(cat, 0)
+        room = max(int(self.limit(cat, "max_hits")) - hits, 0)
+        out = []
+        for i, m in enumerate(islice(matches, room + 1)):
+            if i == room:
+                self._stop(cat, "max_hits")
+                break
+            if i % DEADLINE_EVERY == DEADLINE_EVERY - 1 and self.expired(cat):
+                break
+            out.append(m)
+        self.hits[cat] = hits + len(out)
+        return out
+
+    def lines(self, cat: str, strings: List[Any], pred: Callable[[Any], Any]) -> List[Any]:
+        """The strings for which pred() holds, within cat's budget."""
+        hits = []
+        for batch in self.batches(cat, strings):
+            hits.extend(self.take(cat, [s for s in batch if pred(s)]))
+            if cat in self.truncated:
+                break
+        return hits
+
+    def matches(self, cat: str, strings: List[Any], regex) -> List[Any]:
+        """regex.findall() hits over strings, stopping inside a string at the hit limit."""
+        hits = []
+        for batch in self.batches(cat, strings):
+            for s in batch:
+                if regex.search(s):
+                    hits.extend(self.take_from(cat, lazy_findall(regex, s)))
+                    if cat in self.truncated:
+                        return hits
+        return hits
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            cat: {"reason": reason, "hits": self.hits.get(cat, 0), "bytes_scanned": self.bytes.get(cat, 0)}
+            for cat, reason in self.truncated.items()
+        }
+
+
+def lazy_findall(regex, s) -> Iterator[Any]:
+    """Lazy regex.findall(s): yields what findall would return, one by one."""
+    if regex.groups == 0:
+        return (m.group() for m in regex.finditer(s))
+    if regex.groups == 1:
+        return (m.group(1) for m in regex.finditer(s))
+    return (m.groups() for m in regex.finditer(s))
+
+
+def format_truncated(cat: str, t: Dict[str, Any]) -> str:
+    """One report() entry as text."""
+    return f"{cat}: {t['reason']} after {t['hits']} hits / {t['bytes_scanned']} bytes"
+
+
+# ---------- CLI helpers ----------
+
+def add_budget_args(ap):
+    ap.add_argument("--max-hits", type=int, default=DEFAULT_LIMITS["max_hits"],
+                    help="Per-file, per-category hit limit.")
+    ap.add_argument("--max-bytes", type=int, default=DEFAULT_LIMITS["max_bytes"],
+                    help="Per-file, per-category limit on bytes scanned.")
+    ap.add_argument("--deadline", type=float, default=DEFAULT_LIMITS["deadline"],
+                    help="Per-file wall-clock deadline in seconds.")
+    ap.add_argument("--budget", action="append", default=[], metavar="CATEGORY:KEY=VALUE",
+                    help="Per-category override, e.g. base64_like:max_hits=100 (repeatable).")
+
+
+def budget_from_args(args) -> ScanBudget:
+    """A template ScanBudget from parsed CLI args; call fresh() per file."""
+    overrides: Dict[str, Dict[str, float]] = {}
+    for spec in args.budget:
+        try:
+            cat, kv = spec.split(":", 1)
+            key, val = kv.split("=", 1)
+        except ValueError:
+            raise SystemExit(f"Bad --budget value (want CATEGORY:KEY=VALUE): {spec}")
+        if key not in DEFAULT_LIMITS:
+            raise SystemExit(f"Unknown budget key {key!r}; use one of {', '.join(DEFAULT_LIMITS)}")
+        overrides.setdefault(cat, {})[key] = float(val)
+    return ScanBudget(
+        {"max_hits": args.max_hits, "max_bytes": args.max_bytes, "deadline": args.deadline},
+        overrides,
+    )
@@ -3,7 +3,10 @@ import argparse
 import os
 import re
 import json
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
+
+from scan_budget import ScanBudget, add_budget_args, budget_from_args, format_truncated
+from literal_prefilter import LiteralPrefilter
 
 # ---------- basic helpers ----------
 
@@ -65,81 +68,83 @@ BASE64_KEY_RE = re.compile(r'\b[A-Za-z0-9+/]{22,}={0,2}\b')
 RSA_PEM_RE = re.compile(r'-----BEGIN (RSA |EC |)PUBLIC KEY-----')
 TUYA_SIG_HINT_RE = re.compile(r'(signature|authKey|localKey|HMAC|SHA256|ECDSA|curve25519|X-Amz-Signature)', re.IGNORECASE)
 
+# Required literals of the string finders; a finder is skipped when none of
+# its literals occur in any extracted string (ASCII or UTF-16)
+FINDER_PREFILTERS = {
+    # find_json_like is a substring test, not JSON_RE; "{" is a plain keyword
+    "json_like": LiteralPrefilter([], ["{"]),
+    "mqtt_topics_like": LiteralPrefilter([MQTT_TOPIC_RE]),
+    "tuya_dp_fragments": LiteralPrefilter([TUYA_DP_RE]),
+    "tuya_signature_related": LiteralPrefilter([TUYA_SIG_HINT_RE]),
+}
+RSA_PEM_PREFILTER = LiteralPrefilter([RSA_PEM_RE])
+
 
-def find_json_like(strings: List[str]) -> List[str]:
-    hits = []
-    for s in strings:
-        if "{" in s and "}" in s and ":" in s:
-            if len(s) <= 512:  # crude filter to avoid huge junk
-                hits.append(s)
-    return uniq(hits)
+def find_json_like(strings: List[str], budget: Optional[ScanBudget] = None) -> List[str]:
+    # crude filter: len <= 512 to avoid huge junk
+    return uniq((budget or ScanBudget()).lines(
+        "json_like", strings, lambda s: "{" in s and "}" in s and ":" in s and len(s) <= 512))
 
 
-def find_mqtt_topics(strings: List[str]) -> List[str]:
-    hits = []
-    for s in strings:
-        m = MQTT_TOPIC_RE.findall(s)
-        if m:
-            for _ in m:
-                hits.append(s)
-    return uniq(hits)
+def find_mqtt_topics(strings: List[str], budget: Optional[ScanBudget] = None) -> List[str]:
+    return uniq((budget or ScanBudget()).lines("mqtt_topics_like", strings, MQTT_TOPIC_RE.search))
 
 
-def find_tuya_dp(strings: List[str]) -> List[str]:
-    hits = []
-    for s in strings:
-        if TUYA_DP_RE.search(s):
-            hits.append(s)
-    return uniq(hits)
+def find_tuya_dp(strings: List[str], budget: Optional[ScanBudget] = None) -> List[str]:
+    return uniq((budget or ScanBudget()).lines("tuya_dp_fragments", strings, TUYA_DP_RE.search))
 
 
-def find_keys(strings: List[str]) -> Tuple[List[str], List[str]]:
-    hex_hits = []
-    b64_hits = []
-    for s in strings:
-        hex_hits.extend(AES_KEY_HEX_RE.findall(s))
-        b64_hits.extend(BASE64_KEY_RE.findall(s))
+def find_keys(strings: List[str], budget: Optional[ScanBudget] = None) -> Tuple[List[str], List[str]]:
+    budget = budget or ScanBudget()
+    hex_hits = budget.matches("aes_key_hex_candidates", strings, AES_KEY_HEX_RE)
+    b64_hits = budget.matches("base64_key_candidates", strings, BASE64_KEY_RE)
     return uniq([h if isinstance(h, str) else h.decode("ascii", "ignore") for h in hex_hits]), \
            uniq([b if isinstance(b, str) else b.decode("ascii", "ignore") for b in b64_hits])
 
 
-def find_tuya_sig(strings: List[str]) -> List[str]:
-    hits = []
-    for s in strings:
-        if TUYA_SIG_HINT_RE.search(s):
-            hits.append(s)
-    return uniq(hits)
+def find_tuya_sig(strings: List[str], budget: Optional[ScanBudget] = None) -> List[str]:
+    return uniq((budget or ScanBudget()).lines("tuya_signature_related", strings, TUYA_SIG_HINT_RE.search))
 
 
-def protobuf_entropy_score(data: bytes) -> int:
+def protobuf_entropy_score(data: bytes, budget: Optional[ScanBudget] = None) -> int:
+    budget = budget or ScanBudget()
     # extremely crude score: count of field-tag-like bytes
+    data = data[:budget.allow("protobuf_field_tag_score", len(data))]
     matches = PROTOBUF_FIELD_RE.findall(data)
     return len(matches)
 
 
 # ---------- main analysis ----------
 
-def analyze_binary(path: str) -> Dict[str, Any]:
+def analyze_binary(path: str, budget: Optional[ScanBudget] = None) -> Dict[str, Any]:
+    """budget: template ScanBudget; the binary gets a fresh() one."""
+    budget = (budget or ScanBudget()).fresh()
     data = read_file(path)
+    data = data[:budget.allow("strings", len(data))]
 
     ascii_strings = extract_ascii_strings(data, min_len=4)
     utf16_strings = extract_utf16le_strings(data, min_len=4)
 
     all_strings = ascii_strings + utf16_strings
 
-    json_like = find_json_like(all_strings)
-    mqtt_topics = find_mqtt_topics(all_strings)
-    tuya_dp = find_tuya_dp(all_strings)
-    hex_keys, b64_keys = find_keys(all_strings)
-    tuya_sig = find_tuya_sig(all_strings)
+    text = "\n".join(all_strings)
+    lowered = text.lower()
+    live = {cat for cat, pf in FINDER_PREFILTERS.items() if pf.present(text, lowered)}
+
+    json_like = find_json_like(all_strings, budget) if "json_like" in live else []
+    mqtt_topics = find_mqtt_topics(all_strings, budget) if "mqtt_topics_like" in live else []
+    tuya_dp = find_tuya_dp(all_strings, budget) if "tuya_dp_fragments" in live else []
+    hex_keys, b64_keys = find_keys(all_strings, budget)
+    tuya_sig = find_tuya_sig(all_strings, budget) if "tuya_signature_related" in live else []
 
     rsa_pem = []
-    if RSA_PEM_RE.search(data.decode("latin1", "ignore")):
+    pem_text = data[:budget.allow("rsa_pem_header", len(data))].decode("latin1", "ignore")
+    if next(RSA_PEM_PREFILTER.finditer(RSA_PEM_RE, pem_text), None):
         rsa_pem.append("PEM public key header found (see binary in hex/strings for full block)")
 
-    proto_score = protobuf_entropy_score(data)
+    proto_score = protobuf_entropy_score(data, budget)
 
-    return {
+    res = {
         "path": path,
         "stats": {
             "ascii_strings": len(ascii_strings),
@@ -154,6 +159,10 @@ def analyze_binary(path: str) -> Dict[str, Any]:
         "tuya_signature_related": tuya_sig,
         "rsa_pem_header": rsa_pem,
     }
+    truncated = budget.report()
+    if truncated:
+        res["truncated"] = truncated
+    return res
 
 
 def main():
@@ -162,12 +171,13 @@ def main():
     )
     ap.add_argument("binary", help="Path to binary (e.g. /mnt/tuya/squashfs-root-1/skyeye/bin/tycam)")
     ap.add_argument("--out-json", help="Write JSON report to this file.")
+    add_budget_args(ap)
     args = ap.parse_args()
 
     if not os.path.isfile(args.binary):
         raise SystemExit(f"Binary not found: {args.binary}")
 
-    res = analyze_binary(args.binary)
+    res = analyze_binary(args.binary, budget_from_args(args))
 
     # human-readable
     print(f"=== Deep scan report ===")
@@ -193,6 +203,9 @@ def main():
     dump_section("Tuya signature-related strings", res["tuya_signature_related"])
     dump_section("RSA PEM markers", res["rsa_pem_header"])
 
+    for cat, t in res.get("truncated", {}).items():
+        print(f"[truncated] {format_truncated(cat, t)}")
+
     if args.out_json:
         with open(args.out_json, "w") as f:
             json.dump(res, f, indent=2)
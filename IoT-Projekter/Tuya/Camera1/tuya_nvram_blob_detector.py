@@ -3,6 +3,14 @@ import os
 import re
 import argparse
 import json
+import struct
+import zlib
+from itertools import takewhile
+from typing import Optional
+
+from fuzzy_hash import fuzzy_hash, cluster_by_similarity, summarize_diff, ContentCache
+from scan_budget import ScanBudget, add_budget_args, budget_from_args, format_truncated
+from literal_prefilter import LiteralPrefilter
 
 # Tuya credential markers
 KEYWORDS = [
@@ -17,7 +25,251 @@ ASCII_KV_RE = re.compile(rb"([A-Za-z0-9_]{2,32})=([^\x00\r\n]{1,128})")
 # UTF-16LE KV pattern
 UTF16_KV_RE = re.compile(rb"((?:[A-Za-z0-9_]\x00){2,32})=((?:.\x00){2,128})")
 
-def scan_blob(path):
+# Both KV patterns need a literal "="; the KV regexes only run on windows
+# around "=" hits, and keywords are looked up with the same prefilter class
+KV_PREFILTER = LiteralPrefilter([ASCII_KV_RE, UTF16_KV_RE])
+KEYWORD_PREFILTER = LiteralPrefilter([], KEYWORDS)
+
+# Longest possible KV match (UTF-16 key + "=" + value) is ~322 bytes; keep
+# this much of the previous window so matches across chunk edges are seen.
+SCAN_OVERLAP = 512
+
+# Decompression limits: inflate in bounded windows and bail out on anything
+# that looks like a decompression bomb.
+DECODE_WINDOW = 64 * 1024
+DECODE_MAX_OUTPUT = 16 * 1024 * 1024
+DECODE_MAX_RATIO = 200
+# A 2-byte zlib header matches ~1 in 1000 arbitrary files (plain text starting
+# with "HK", "x^", ...). A stream that fails before giving this much output
+# was no stream at all; its bytes are scanned raw instead.
+DECODE_MIN_OUTPUT = 256
+
+# JFFS2 node layout (see linux/jffs2.h)
+JFFS2_MAGIC_LE = b"\x85\x19"
+JFFS2_MAGIC_BE = b"\x19\x85"
+JFFS2_NODETYPE_DIRENT = 0xE001
+JFFS2_NODETYPE_INODE = 0xE002
+JFFS2_NODETYPES = {0xE001, 0xE002, 0x2003, 0x2004, 0x2006, 0xE008, 0xE009}
+JFFS2_DIRENT_HDR = 40
+JFFS2_INODE_HDR = 68
+JFFS2_COMPR_NONE = 0x00
+JFFS2_COMPR_ZERO = 0x05
+JFFS2_COMPR_ZLIB = 0x06
+
+
+def new_matches():
+    # *_end: absolute offset where the last kept match of each regex ended
+    return {"keyword_hits": set(), "ascii_kv": [], "utf16_kv": [], "ascii_end": 0, "utf16_end": 0}
+
+
+MATCH_CATEGORIES = ("keyword_hits", "ascii_kv", "utf16_kv")
+
+
+def match_window(buf, base, limit, acc, budget):
+    """
+    Run keyword/KV matchers over buf (which starts at absolute offset base),
+    keeping only matches that start before limit. Matches kept from an
+    earlier window are not matched again. Only the first limit bytes count
+    against the budget; the rest is overlap for the next window.
+    """
+    if budget.allow("keyword_hits", limit):
+        new = KEYWORD_PREFILTER.found(buf) - acc["keyword_hits"]
+        acc["keyword_hits"].update(budget.take("keyword_hits", sorted(new)))
+
+    for regex, out_key, end_key, enc in (
+        (ASCII_KV_RE, "ascii_kv", "ascii_end", "ascii"),
+        (UTF16_KV_RE, "utf16_kv", "utf16_end", "utf-16le"),
+    ):
+        end = budget.allow(out_key, limit)
+        if not end:
+            continue
+        found = takewhile(lambda m: m.start() < end,
+                          KV_PREFILTER.finditer(regex, buf, max(0, acc[end_key] - base), end))
+        for m in budget.take_from(out_key, found):
+            acc[out_key].append((m.group(1).decode(enc, "ignore"), m.group(2).decode(enc, "ignore")))
+            acc[end_key] = base + m.end()
+
+
+def scan_stream(chunks, budget):
+    """
+    Feed an iterable of byte chunks through the matchers without ever holding
+    more than one chunk plus SCAN_OVERLAP bytes in memory. Stops pulling
+    chunks (and so decoding) once every category is out of budget.
+    """
+    acc = new_matches()
+    buf = b""
+    base = 0
+    for chunk in chunks:
+        buf += chunk
+        if len(buf) <= 2 * SCAN_OVERLAP:
+            continue
+        cut = len(buf) - SCAN_OVERLAP
+        match_window(buf, base, cut, acc, budget)
+        buf = buf[cut:]
+        base += cut
+        if all(c in budget.truncated or budget.expired(c) for c in MATCH_CATEGORIES):
+            return acc
+    if buf:
+        match_window(buf, base, len(buf), acc, budget)
+    return acc
+
+
+def matches_to_hits(acc, hits, budget):
+    keyword_hits = [kw.decode("ascii", "ignore") for kw in KEYWORDS if kw in acc["keyword_hits"]]
+    if keyword_hits:
+        hits["keyword_hits"] = keyword_hits
+    if acc["ascii_kv"]:
+        hits["ascii_kv"] = acc["ascii_kv"]
+    if acc["utf16_kv"]:
+        hits["utf16_kv"] = acc["utf16_kv"]
+    truncated = budget.report()
+    if truncated:
+        hits["truncated"] = truncated
+    return hits
+
+
+# ---------- decoders ----------
+
+def detect_codec(data):
+    if len(data) >= 12 and data[:2] in (JFFS2_MAGIC_LE, JFFS2_MAGIC_BE):
+        endian = "<" if data[:2] == JFFS2_MAGIC_LE else ">"
+        (nodetype,) = struct.unpack_from(endian + "H", data, 2)
+        if nodetype in JFFS2_NODETYPES:
+            return "jffs2"
+    if len(data) >= 2 and is_zlib_header(data):
+        return "zlib"
+    return None
+
+
+def is_zlib_header(data):
+    cmf, flg = data[0], data[1]
+    return (cmf & 0x0F) == 8 and (cmf >> 4) <= 7 and ((cmf << 8) | flg) % 31 == 0
+
+
+def decode_budget_hit(state):
+    if state["out"] > DECODE_MAX_OUTPUT:
+        state["decode_limit"] = "max_output"
+    elif state["out"] > DECODE_WINDOW and state["out"] > DECODE_MAX_RATIO * state["in"]:
+        state["decode_limit"] = "ratio"
+    return "decode_limit" in state
+
+
+def inflate(data, state, wbits=zlib.MAX_WBITS):
+    """
+    Yield decoded chunks of the zlib stream at the start of data, at most
+    DECODE_WINDOW bytes at a time. Sets state["consumed"] to the number of
+    compressed bytes the stream used and state["eof"] once it ended.
+    """
+    d = zlib.decompressobj(wbits)
+    base_in = state["in"]
+    fed = 0
+    pending = b""
+    state["consumed"] = 0
+    while not d.eof:
+        if not pending and fed < len(data):
+            pending = data[fed:fed + DECODE_WINDOW]
+            fed += len(pending)
+        try:
+            out = d.decompress(pending, DECODE_WINDOW)
+        except zlib.error as e:
+            state["error"] = str(e)
+            return
+        pending = d.unconsumed_tail
+        state["consumed"] = fed - len(pending) - len(d.unused_data)
+        state["in"] = base_in + state["consumed"]
+        state["eof"] = d.eof
+        if out:
+            state["out"] += len(out)
+            yield out
+        if decode_budget_hit(state):
+            return
+        if not out and not pending and fed >= len(data):
+            break
+
+
+def iter_jffs2(data, state):
+    """Walk JFFS2 nodes and yield dirent names and decoded inode payloads."""
+    magic = data[:2]
+    endian = "<" if magic == JFFS2_MAGIC_LE else ">"
+    pos = 0
+    state["nodes"] = 0
+    state["skipped_nodes"] = 0
+    while pos + 12 <= len(data):
+        if data[pos:pos + 2] != magic:
+            nxt = data.find(magic, pos + 1)
+            if nxt < 0:
+                break
+            pos = nxt
+            continue
+
+        nodetype, totlen = struct.unpack_from(endian + "HI", data, pos + 2)
+        if totlen < 12 or pos + totlen > len(data):
+            pos += 4
+            continue
+        node = data[pos:pos + totlen]
+        pos += (totlen + 3) & ~3
+        state["nodes"] += 1
+        state["in"] += totlen
+
+        if nodetype == JFFS2_NODETYPE_DIRENT and totlen >= JFFS2_DIRENT_HDR:
+            nsize = node[28]
+            name = node[JFFS2_DIRENT_HDR:JFFS2_DIRENT_HDR + nsize]
+            state["out"] += len(name) + 1
+            yield name + b"\n"
+
+        elif nodetype == JFFS2_NODETYPE_INODE and totlen >= JFFS2_INODE_HDR:
+            csize, dsize = struct.unpack_from(endian + "II", node, 48)
+            compr = node[56]
+            payload = node[JFFS2_INODE_HDR:JFFS2_INODE_HDR + csize]
+            if compr == JFFS2_COMPR_NONE:
+                payload = payload[:dsize]
+                state["out"] += len(payload)
+                yield payload
+            elif compr == JFFS2_COMPR_ZLIB:
+                # node size was already counted above
+                state["in"] -= totlen
+                wbits = zlib.MAX_WBITS if len(payload) >= 2 and is_zlib_header(payload) else -zlib.MAX_WBITS
+                yield from inflate(payload, state, wbits)
+                state["in"] += totlen - state["consumed"]
+            elif compr != JFFS2_COMPR_ZERO:
+                # rtime/rubin/lzo/lzma: not decoded here
+                state["skipped_nodes"] += 1
+
+        if decode_budget_hit(state):
+            return
+
+
+def decode_blob(data, codec, budget):
+    """
+    Stream-decode a compressed carve straight into the matchers. Returns the
+    decoded hits and how many input bytes the decoder consumed. A zlib
+    stream that was not decoded to its end (decode limit, scan budget or a
+    corrupt stream) counts as fully consumed: its remaining bytes are still
+    deflate data and would only give garbage matches. One that failed
+    before DECODE_MIN_OUTPUT bytes was a false header and consumed nothing.
+    """
+    state = {"in": 0, "out": 0, "consumed": 0}
+    if codec == "zlib":
+        acc = scan_stream(inflate(data, state), budget)
+        if state.get("eof"):
+            consumed = state["consumed"]
+        elif "error" in state and state["out"] < DECODE_MIN_OUTPUT:
+            consumed = 0
+        else:
+            consumed = len(data)
+    else:
+        acc = scan_stream(iter_jffs2(data, state), budget)
+        consumed = len(data)
+
+    decoded = {"codec": codec, "input_bytes": state["in"], "output_bytes": state["out"]}
+    for key in ("decode_limit", "error", "nodes", "skipped_nodes"):
+        if state.get(key):
+            decoded[key] = state[key]
+    matches_to_hits(acc, decoded, budget)
+    return decoded, consumed
+
+
+def load_blob(path):
     try:
         with open(path, "rb") as f:
             data = f.read()
@@ -27,52 +279,160 @@ def scan_blob(path):
     size = len(data)
     if size < 32 or size > 1024 * 1024:
         return None
+    return data
+
+
+def cluster_partition(data):
+    """
+    Compressed carves only cluster with carves starting with the same stream:
+    binwalk carves run to the end of the image, so neighbouring carves are
+    near-identical suffixes of each other but decode to different content.
+    """
+    codec = detect_codec(data)
+    if codec:
+        return codec, zlib.crc32(data[:256])
+    return None
+
+
+def scan_blob(path, budget: Optional[ScanBudget] = None):
+    data = load_blob(path)
+    if data is None:
+        return None
+    return scan_data(data, budget)
+
 
+def scan_data(data, budget: Optional[ScanBudget] = None, fuzzy=None):
+    """
+    budget: template ScanBudget; raw and decoded bytes get a fresh() one each.
+    fuzzy: the fuzzy hash of data, if the caller computed one (for clustering);
+    it is only added to the result, never computed here.
+    """
+    budget = budget or ScanBudget()
+    size = len(data)
     hits = {}
 
-    # 1. Keyword search
-    keyword_hits = []
-    for kw in KEYWORDS:
-        if kw in data:
-            keyword_hits.append(kw.decode("ascii", "ignore"))
-    if keyword_hits:
-        hits["keyword_hits"] = keyword_hits
+    # 1. Compressed carves: scan the decoded stream, and only the raw bytes
+    #    left over after it (scanning deflate output as text gives garbage)
+    raw = data
+    codec = detect_codec(data)
+    if codec:
+        decoded, consumed = decode_blob(data, codec, budget.fresh())
+        raw = data[consumed:]
+        if any(k in decoded for k in ("decode_limit", "error", "truncated") + MATCH_CATEGORIES):
+            hits["decoded"] = decoded
+
+    # 2. Keyword search, ASCII key=value and UTF-16LE key=value on raw bytes
+    #    (the prefilters inside match_window skip data without the literals)
+    raw_budget = budget.fresh()
+    matches_to_hits(scan_stream([raw], raw_budget), hits, raw_budget)
 
-    # 2. ASCII key=value
-    ascii_hits = []
-    for m in ASCII_KV_RE.findall(data):
-        key = m[0].decode("ascii", "ignore")
-        val = m[1].decode("ascii", "ignore")
-        ascii_hits.append((key, val))
-    if ascii_hits:
-        hits["ascii_kv"] = ascii_hits
-
-    # 3. UTF-16LE key=value
-    utf16_hits = []
-    for m in UTF16_KV_RE.findall(data):
-        key = m[0].decode("utf-16le", "ignore")
-        val = m[1].decode("utf-16le", "ignore")
-        utf16_hits.append((key, val))
-    if utf16_hits:
-        hits["utf16_kv"] = utf16_hits
-
-    # 4. Heuristic: looks like TLV or structured binary
+    # 3. Heuristic: looks like TLV or structured binary
     entropy = len(set(data))
     if entropy < 200:
         hits["low_entropy_hint"] = True
 
     if hits:
         hits["size"] = size
+        if fuzzy:
+            hits["fuzzy_hash"] = fuzzy
         return hits
 
     return None
 
 
+def changed_matches(data, start, end, budget):
+    """
+    Keywords and KV pairs of data that overlap data[start:end], scanning only
+    SCAN_OVERLAP bytes either side of it (a KV match is narrower than that).
+    """
+    lo, hi = max(0, start - SCAN_OVERLAP), min(len(data), end + SCAN_OVERLAP)
+    acc = new_matches()
+    if budget.allow("keyword_hits", hi - lo):
+        acc["keyword_hits"] = set(budget.take("keyword_hits", sorted(KEYWORD_PREFILTER.found(data[lo:hi]))))
+    for regex, out_key, enc in ((ASCII_KV_RE, "ascii_kv", "ascii"), (UTF16_KV_RE, "utf16_kv", "utf-16le")):
+        if not budget.allow(out_key, hi - lo):
+            continue
+        found = (m for m in KV_PREFILTER.finditer(regex, data, lo, hi) if m.end() > start)
+        found = takewhile(lambda m: m.start() < end, found)
+        acc[out_key] = [(m.group(1).decode(enc, "ignore"), m.group(2).decode(enc, "ignore"))
+                        for m in budget.take_from(out_key, found)]
+    return matches_to_hits(acc, {}, budget)
+
+
+def member_diff(rep_data, rep_res, data, rep_hash, member_hash, budget):
+    """
+    summarize_diff() plus the keywords and KV pairs of a cluster member that
+    the representative does not have. Raw blobs are only matched around the
+    changed range; compressed carves can differ anywhere once decoded, so
+    they are scanned in full.
+    """
+    diff = summarize_diff(rep_data, data, rep_hash, member_hash)
+    if diff["identical"]:
+        return diff
+    if detect_codec(data):
+        found = scan_data(data, budget, member_hash) or {}
+        found = dict(found, **{k: found.get(k, []) + found.get("decoded", {}).get(k, [])
+                                for k in MATCH_CATEGORIES})
+    else:
+        found = changed_matches(data, *diff["changed_range"], budget.fresh())
+
+    for cat in MATCH_CATEGORIES:
+        known = set(rep_res.get(cat, [])) | set(rep_res.get("decoded", {}).get(cat, []))
+        new = [hit for hit in found.get(cat, []) if hit not in known]
+        if new:
+            diff["new_" + cat] = new
+    if found.get("truncated"):
+        diff["truncated"] = found["truncated"]
+    return diff
+
+
+def print_result(rel, res):
+    print(f"[+] Possible NVRAM blob: {rel}")
+    if "keyword_hits" in res:
+        print("    Keywords:", res["keyword_hits"])
+    if "ascii_kv" in res:
+        print("    ASCII KV pairs:", len(res["ascii_kv"]))
+    if "utf16_kv" in res:
+        print("    UTF16 KV pairs:", len(res["utf16_kv"]))
+    if "decoded" in res:
+        dec = res["decoded"]
+        print(f"    Decoded {dec['codec']}: {dec['input_bytes']} -> {dec['output_bytes']} bytes"
+              + (f" (stopped: {dec['decode_limit']})" if "decode_limit" in dec else "")
+              + (f" (error: {dec['error']})" if "error" in dec else ""))
+        if "keyword_hits" in dec:
+            print("      Keywords:", dec["keyword_hits"])
+        if "ascii_kv" in dec:
+            print("      ASCII KV pairs:", len(dec["ascii_kv"]))
+        if "utf16_kv" in dec:
+            print("      UTF16 KV pairs:", len(dec["utf16_kv"]))
+        for cat, t in dec.get("truncated", {}).items():
+            print(f"      Truncated {format_truncated(cat, t)}")
+    for cat, t in res.get("truncated", {}).items():
+        print(f"    Truncated {format_truncated(cat, t)}")
+    print("    Size:", res["size"])
+    if "cluster" in res:
+        print(f"    Cluster: {len(res['cluster'])} near-duplicate(s)")
+        for member, diff in res["cluster"].items():
+            print(f"      {member}: similarity {diff.get('similarity')}, "
+                  f"size {diff['size_delta']:+d}, changed {diff['changed_range']}")
+            if "new_keyword_hits" in diff:
+                print("        New keywords:", diff["new_keyword_hits"])
+            for key, val in diff.get("new_ascii_kv", []) + diff.get("new_utf16_kv", []):
+                print(f"        New pair: {key}={val}")
+    print()
+
+
 def main():
     ap = argparse.ArgumentParser(description="Detect Tuya/Realtek NVRAM blobs in firmware dumps.")
     ap.add_argument("path", help="Directory containing extracted firmware partitions (binwalk output).")
     ap.add_argument("--out-json", help="Write results to JSON.")
+    ap.add_argument("--similarity", type=int, default=80,
+                    help="Fuzzy-hash score (0-100) at which blobs are treated as near-duplicates.")
+    ap.add_argument("--no-cluster", action="store_true",
+                    help="Analyse every blob on its own instead of one per cluster.")
+    add_budget_args(ap)
     args = ap.parse_args()
+    budget = budget_from_args(args)
 
     root = args.path
     results = {}
@@ -80,23 +440,47 @@ def main():
     print(f"=== Tuya RTS3903 NVRAM Blob Detector ===")
     print(f"Scanning: {root}\n")
 
+    # 1. Fuzzy-hash every candidate blob (only needed for clustering)
+    hashes = {}
+    sizes = {}
+    partitions = {}
+    cache = ContentCache(lambda rel: load_blob(os.path.join(root, rel)) or b"")
     for dirpath, dirs, files in os.walk(root):
         for fn in files:
             full = os.path.join(dirpath, fn)
+            data = load_blob(full)
+            if data is None:
+                continue
             rel = os.path.relpath(full, root)
+            hashes[rel] = None if args.no_cluster else fuzzy_hash(data)
+            sizes[rel] = len(data)
+            cache.put(rel, data)
+            partitions.setdefault(cluster_partition(data), []).append(rel)
+
+    # 2. Group near-duplicates; analyse one representative per cluster
+    clusters = []
+    for members in partitions.values():
+        if args.no_cluster:
+            clusters.extend([m] for m in members)
+        else:
+            clusters.extend(cluster_by_similarity({m: hashes[m] for m in members}, args.similarity))
+    print(f"{len(hashes)} blobs in {len(clusters)} clusters\n")
 
-            res = scan_blob(full)
-            if res:
-                results[rel] = res
-                print(f"[+] Possible NVRAM blob: {rel}")
-                if "keyword_hits" in res:
-                    print("    Keywords:", res["keyword_hits"])
-                if "ascii_kv" in res:
-                    print("    ASCII KV pairs:", len(res["ascii_kv"]))
-                if "utf16_kv" in res:
-                    print("    UTF16 KV pairs:", len(res["utf16_kv"]))
-                print("    Size:", res["size"])
-                print()
+    for members in sorted(clusters):
+        # largest member as representative: appended records are then covered
+        members.sort(key=lambda rel: -sizes[rel])
+        rep = members[0]
+        rep_data = cache.get(rep)
+        res = scan_data(rep_data, budget, hashes[rep])
+        if not res:
+            continue
+        if len(members) > 1:
+            res["cluster"] = {
+                m: member_diff(rep_data, res, cache.get(m), hashes[rep], hashes[m], budget)
+                for m in members[1:]
+            }
+        results[rep] = res
+        print_result(rep, res)
 
     if not results:
         print("No NVRAM-like blobs detected. Try scanning the raw firmware .bin file directly.")
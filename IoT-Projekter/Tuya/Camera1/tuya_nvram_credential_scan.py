@@ -3,9 +3,14 @@ import os
 import re
 import argparse
 import json
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
+
+from scan_budget import ScanBudget, add_budget_args, budget_from_args, format_truncated
+from literal_prefilter import LiteralPrefilter
 
 NV_GET_RE = re.compile(rb'nvram\s+get\s+([A-Za-z0-9_]+)')
+# NV_GET_RE can only match where "nvram" occurs
+NV_GET_PREFILTER = LiteralPrefilter([NV_GET_RE])
 NV_FILE_NAME_RE = re.compile(r'nvram', re.IGNORECASE)
 
 
@@ -27,20 +32,30 @@ def find_nvram_binary(root: str) -> List[str]:
     return hits
 
 
-def scan_for_nvram_gets(root: str) -> Dict[str, List[str]]:
+def scan_for_nvram_gets(root: str, budget: Optional[ScanBudget] = None,
+                        truncated: Dict[str, Any] = None) -> Dict[str, List[str]]:
+    """budget: template ScanBudget, fresh() per file; files that ran out go into truncated."""
+    budget = budget or ScanBudget()
     keys_to_files: Dict[str, List[str]] = {}
     for path in walk_files(root):
+        file_budget = budget.fresh()
         try:
             with open(path, "rb") as f:
-                data = f.read()
+                data = f.read(file_budget.allow("nvram_get", os.path.getsize(path)))
         except Exception:
             continue
 
-        matches = NV_GET_RE.findall(data)
+        rel = os.path.relpath(path, root)
+        matches = []
+        if NV_GET_PREFILTER.present(data):
+            found = (m.group(1) for m in NV_GET_PREFILTER.finditer(NV_GET_RE, data))
+            matches = file_budget.take_from("nvram_get", found)
+        # a file cut at max_bytes is recorded even when the cut part held every hit
+        if truncated is not None and file_budget.truncated:
+            truncated[rel] = file_budget.report()
         if not matches:
             continue
 
-        rel = os.path.relpath(path, root)
         for m in matches:
             try:
                 key = m.decode("ascii", "ignore")
@@ -78,6 +93,7 @@ def main():
         "--out-json",
         help="Optional JSON file to write structured results to.",
     )
+    add_budget_args(ap)
     args = ap.parse_args()
 
     root = args.rootfs
@@ -95,7 +111,8 @@ def main():
     print()
 
     # 2) Find nvram get KEY usage across scripts/binaries
-    keys_to_files = scan_for_nvram_gets(root)
+    truncated: Dict[str, Any] = {}
+    keys_to_files = scan_for_nvram_gets(root, budget_from_args(args), truncated)
 
     # highlight keys that look like credentials / IDs
     interesting_prefixes = ["UUID", "AUTHKEY", "P2PID", "PID", "DEV", "MAC", "ETH_", "WIFI", "TZ"]
@@ -109,6 +126,13 @@ def main():
             print(f"    {f}")
     print()
 
+    if truncated:
+        print(f"[truncated scans] ({len(truncated)} files hit a scan budget)")
+        for rel, cats in sorted(truncated.items()):
+            for cat, t in cats.items():
+                print(f"  {rel}: {format_truncated(cat, t)}")
+        print()
+
     print(f"[likely credential-related keys]")
     if not interesting_keys:
         print("  (none matched simple prefixes; check full list above)")
@@ -133,6 +157,7 @@ def main():
             "nvram_keys": keys_to_files,
             "interesting_keys": interesting_keys,
             "nvram_storage_candidates": nv_files,
+            "truncated": truncated,
         }
         with open(args.out_json, "w") as f:
             json.dump(out, f, indent=2)
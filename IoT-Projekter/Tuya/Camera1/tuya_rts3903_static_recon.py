@@ -3,7 +3,11 @@ import os
 import re
 import json
 import argparse
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Set
+
+from fuzzy_hash import fuzzy_hash, cluster_by_similarity, summarize_diff, ContentCache
+from scan_budget import ScanBudget, add_budget_args, budget_from_args, format_truncated
+from literal_prefilter import LiteralPrefilter
 
 # ---------- simple helpers ----------
 
@@ -16,14 +20,17 @@ def is_probably_elf(path: str) -> bool:
         return False
 
 
-def extract_ascii_strings(path: str, min_len: int = 4) -> List[str]:
-    strings = []
+def extract_ascii_strings(path: str, min_len: int = 4, max_bytes: int = -1) -> List[str]:
     try:
         with open(path, "rb") as f:
-            data = f.read()
+            data = f.read(max_bytes)
     except Exception:
-        return strings
+        return []
+    return ascii_strings(data, min_len)
 
+
+def ascii_strings(data: bytes, min_len: int = 4) -> List[str]:
+    strings = []
     cur = []
     for b in data:
         if 32 <= b < 127:  # printable ASCII
@@ -73,45 +80,52 @@ SENSOR_RE = re.compile(
 
 PAIRING_RE = re.compile(r"(pairing|ap_mode|smartconfig|ezconfig|binding|unbind|activation)", re.IGNORECASE)
 
-
-def analyze_strings(strings: List[str]) -> Dict[str, List[str]]:
-    urls = []
-    hosts = []
-    mqtt_strings = []
-    mqtt_topics = []
-    device_id_hits = []
-    key_like = []
-    base64_like = []
-    realtek = []
-    ioctls = []
-    sensor = []
-    pairing = []
-
-    for s in strings:
-        if URL_RE.search(s):
-            urls.extend(URL_RE.findall(s))
-        if HOST_RE.search(s):
-            hosts.extend(HOST_RE.findall(s))
-        if MQTT_RE.search(s):
-            mqtt_strings.append(s)
-        if TOPIC_RE.search(s):
-            mqtt_topics.extend([m for m in TOPIC_RE.findall(s) if len(m) > 4])
-        for key in DEVICE_ID_KEYS:
-            if key in s:
-                device_id_hits.append(s)
-                break
-        if KEY_LIKE_RE.search(s):
-            key_like.extend(KEY_LIKE_RE.findall(s))
-        if BASE64_RE.search(s):
-            base64_like.extend(BASE64_RE.findall(s))
-        if REALTEK_RE.search(s):
-            realtek.append(s)
-        if IOCTL_RE.search(s):
-            ioctls.append(s)
-        if SENSOR_RE.search(s):
-            sensor.append(s)
-        if PAIRING_RE.search(s):
-            pairing.append(s)
+# Required literals per category; a category is skipped for files that
+# contain none of them. key_like/base64_like have none and always run.
+CATEGORY_PREFILTERS = {
+    "urls": LiteralPrefilter([URL_RE]),
+    "hosts": LiteralPrefilter([HOST_RE]),
+    "mqtt_strings": LiteralPrefilter([MQTT_RE]),
+    "mqtt_topics": LiteralPrefilter([TOPIC_RE]),
+    "device_id_hits": LiteralPrefilter([], DEVICE_ID_KEYS),
+    "key_like": LiteralPrefilter([KEY_LIKE_RE]),
+    "base64_like": LiteralPrefilter([BASE64_RE]),
+    "realtek": LiteralPrefilter([REALTEK_RE]),
+    "ioctls": LiteralPrefilter([IOCTL_RE]),
+    "sensor": LiteralPrefilter([SENSOR_RE]),
+    "pairing": LiteralPrefilter([PAIRING_RE]),
+}
+
+
+def live_categories(strings: List[str]) -> Set[str]:
+    text = "\n".join(strings)
+    lowered = text.lower()
+    return {cat for cat, pf in CATEGORY_PREFILTERS.items() if pf.present(text, lowered)}
+
+
+def analyze_strings(strings: List[str], budget: Optional[ScanBudget] = None,
+                    live: Optional[Set[str]] = None) -> Dict[str, List[str]]:
+    budget = budget or ScanBudget()
+    live = set(CATEGORY_PREFILTERS) if live is None else live
+
+    # One pass per live category over the strings, within its budget
+    def matches(cat, regex):
+        return budget.matches(cat, strings, regex) if cat in live else []
+
+    def lines(cat, pred):
+        return budget.lines(cat, strings, pred) if cat in live else []
+
+    urls = matches("urls", URL_RE)
+    hosts = matches("hosts", HOST_RE)
+    mqtt_strings = lines("mqtt_strings", MQTT_RE.search)
+    mqtt_topics = [m for m in matches("mqtt_topics", TOPIC_RE) if len(m) > 4]
+    device_id_hits = lines("device_id_hits", lambda s: any(key in s for key in DEVICE_ID_KEYS))
+    key_like = matches("key_like", KEY_LIKE_RE)
+    base64_like = matches("base64_like", BASE64_RE)
+    realtek = lines("realtek", REALTEK_RE.search)
+    ioctls = lines("ioctls", IOCTL_RE.search)
+    sensor = lines("sensor", SENSOR_RE.search)
+    pairing = lines("pairing", PAIRING_RE.search)
 
     return {
         "urls": uniq_preserve(urls),
@@ -158,10 +172,24 @@ def build_qiling_profile_skeleton(rootfs: str, tycam_path: str) -> Dict[str, Any
 
 # ---------- main scan ----------
 
-def scan_rootfs(root: str, out_json: str = None, qiling_profile: str = None):
+def read_bytes(path: str) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except Exception:
+        return b""
+
+
+def scan_rootfs(root: str, out_json: str = None, qiling_profile: str = None,
+                similarity: int = 80, cluster: bool = True, budget: Optional[ScanBudget] = None):
     results: Dict[str, Any] = {}
     tycam_candidate = None
 
+    # Fuzzy-hash every ELF so near-identical binaries (e.g. the same tool in
+    # several firmware versions) are analysed once per cluster
+    hashes: Dict[str, str] = {}
+    sizes: Dict[str, int] = {}
+    cache = ContentCache(lambda rel: read_bytes(os.path.join(root, rel)))
     for dirpath, dirnames, filenames in os.walk(root):
         for fn in filenames:
             full = os.path.join(dirpath, fn)
@@ -169,20 +197,48 @@ def scan_rootfs(root: str, out_json: str = None, qiling_profile: str = None):
                 continue
 
             rel = os.path.relpath(full, root)
-            strings = extract_ascii_strings(full)
-            info = analyze_strings(strings)
-
-            # Save non‑empty data only
-            if any(info.values()):
-                results[rel] = info
+            data = read_bytes(full)
+            hashes[rel] = fuzzy_hash(data)
+            sizes[rel] = len(data)
+            cache.put(rel, data)
 
             # Try to spot tycam automatically
             if os.path.basename(full) == "tycam":
                 tycam_candidate = full
 
+    if cluster:
+        clusters = cluster_by_similarity(hashes, similarity)
+    else:
+        clusters = [[rel] for rel in hashes]
+
+    for members in clusters:
+        # tycam is the binary we care most about; never hide it in a cluster.
+        # Otherwise the largest member represents the cluster.
+        members.sort(key=lambda rel: (os.path.basename(rel) != "tycam", -sizes[rel]))
+        rep = members[0]
+        file_budget = (budget or ScanBudget()).fresh()
+        rep_data = cache.get(rep)
+        data = rep_data[:file_budget.allow("strings", len(rep_data))]
+        strings = ascii_strings(data)
+        info = analyze_strings(strings, file_budget, live_categories(strings))
+
+        # Save non‑empty data only, but never drop a file that ran out of budget
+        truncated = file_budget.report()
+        if any(info.values()) or truncated:
+            if truncated:
+                info["truncated"] = truncated
+            info["fuzzy_hash"] = hashes[rep]
+            if len(members) > 1:
+                info["cluster"] = {
+                    m: summarize_diff(rep_data, cache.get(m), hashes[rep], hashes[m])
+                    for m in members[1:]
+                }
+            results[rep] = info
+
     # Print human‑readable report
     print("=== Tuya RTS3903 Static Recon Report ===")
     print(f"Rootfs: {root}")
+    print(f"Binaries: {len(hashes)} in {len(clusters)} clusters")
     print(f"Binaries analyzed: {len(results)}")
     print()
 
@@ -207,6 +263,11 @@ def scan_rootfs(root: str, out_json: str = None, qiling_profile: str = None):
             print(f"  [{key}]")
             for v in vals:
                 print(f"    {v}")
+        for cat, t in info.get("truncated", {}).items():
+            print(f"  [truncated] {format_truncated(cat, t)}")
+        for member, diff in info.get("cluster", {}).items():
+            print(f"  [near-duplicate] {member}: similarity {diff.get('similarity')}, "
+                  f"size {diff['size_delta']:+d}, changed {diff['changed_range']}")
         print()
 
     # Build Qiling profile skeleton if requested
@@ -248,9 +309,23 @@ def main():
         "--qiling-profile",
         help="Optional path to write a Qiling profile skeleton for tycam.",
     )
+    ap.add_argument(
+        "--similarity",
+        type=int,
+        default=80,
+        help="Fuzzy-hash score (0-100) at which binaries are treated as near-duplicates.",
+    )
+    ap.add_argument(
+        "--no-cluster",
+        action="store_true",
+        help="Analyse every binary on its own instead of one per cluster.",
+    )
+    add_budget_args(ap)
     args = ap.parse_args()
 
-    scan_rootfs(args.rootfs, out_json=args.out_json, qiling_profile=args.qiling_profile)
+    scan_rootfs(args.rootfs, out_json=args.out_json, qiling_profile=args.qiling_profile,
+                similarity=args.similarity, cluster=not args.no_cluster,
+                budget=budget_from_args(args))
 
 
 if __name__ == "__main__":